@@ -8,7 +8,7 @@ Features:
 - Index building utility
 - Preset configurations (fast/sensitive)
 - Strand-specific alignment options
-- SAMtools integration for BAM conversion
+- SAMtools integration for sorted BAM or CRAM output (piped, no intermediate SAM)
 - Real-time progress monitoring
 """
 
@@ -16,11 +16,412 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import subprocess
 import os
-from pathlib import Path
+import re
+import shutil
+import errno
+import signal
+import glob
+import json
+import hashlib
+import tempfile
 import threading
+import selectors
+import queue
+from collections import defaultdict
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
 from datetime import datetime
 import webbrowser
 
+try:
+    import xxhash  # Optional, faster fingerprints
+except ImportError:
+    xxhash = None
+
+FASTQ_EXTENSIONS = ('.fastq', '.fq', '.fastq.gz', '.fq.gz')
+_HT2_SUFFIX = re.compile(r'\.\d+\.ht2$')
+_MATE_SUFFIX = re.compile(r'(?:_R?|\.)([12])(?:_001)?\.(?:fastq|fq)(?:\.gz)?$')
+_FQ_SUFFIX = re.compile(r'(?:_R?[12](?:_001)?|\.[12])?\.(?:fastq|fq)(?:\.gz)?$', re.I)
+_FQ_EXTENSION = re.compile(r'\.(?:fastq|fq)(?:\.gz)?$', re.I)
+
+# Lines kept in each log console; older lines are dropped
+MAX_LOG_LINES = 5000
+
+# hisat2-build per-block lines, shown as progress instead of logged
+_BUILD_BLOCK = re.compile(r'Getting block (\d+) of (\d+)')
+_BUILD_BLOCK_DETAIL = re.compile(
+    r'^\s*(?:Getting block|Reserving size|Calculating Z arrays|Entering block accumulator'
+    r'|bucket \d+:|Sorting block|Returning block|Avg bucket|\(Using difference cover\))')
+
+# Index written next to each sorted output format
+INDEX_SUFFIXES = {'bam': '.bai', 'cram': '.crai'}
+
+# Fingerprints of finished samples, kept per output directory
+CACHE_FILE = '.hisat2_gui_cache.json'
+_cache_lock = threading.Lock()
+
+@lru_cache(maxsize=None)
+def find_executable(name):
+    """Resolve an executable (bare name or path) once, falling back to it unchanged"""
+    return shutil.which(name) or name  # Default to hoping it's in PATH
+
+def fastq_sample_name(path, paired=False):
+    """Sample name from a FASTQ path: drop the extension, and the mate suffix for paired data"""
+    return (_FQ_SUFFIX if paired else _FQ_EXTENSION).sub('', os.path.basename(path))
+
+def available_cpus():
+    """Number of CPUs this process may run on (honours affinity masks and cpusets)"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 4
+
+def physical_memory():
+    """Total RAM in bytes, or None where it cannot be determined"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def parse_size(size):
+    """Bytes in a samtools-style size such as 768M or 2G"""
+    unit = size[-1:].upper()
+    if unit and unit in 'KMG':
+        return int(size[:-1]) * 1024 ** ('KMG'.index(unit) + 1)
+    return int(size)
+
+def index_files(index):
+    """All files of a HISAT2 index base path (.N.ht2, or .N.ht2l for large indexes)"""
+    return sorted(glob.glob(glob.escape(index) + '.*.ht2*'))
+
+def prefetch_index(index):
+    """Ask the kernel to start reading an index into the page cache in the background"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for path in index_files(index):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+def alignment_fingerprint(index, files, argv):
+    """Fingerprint an alignment from index/FASTQ sizes and mtimes plus the exact command"""
+    digest = xxhash.xxh3_64() if xxhash is not None else hashlib.blake2b(digest_size=8)
+    for path in index_files(index) + list(files):
+        st = os.stat(path)
+        digest.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\0".encode())
+    digest.update("\0".join(argv).encode())
+    return digest.hexdigest()
+
+def read_cache(output_dir):
+    """Load the sample -> fingerprint map of an output directory"""
+    try:
+        with open(os.path.join(output_dir, CACHE_FILE)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+def update_cache(output_dir, name, fingerprint):
+    """Record the fingerprint of a finished sample, or forget it when fingerprint is None"""
+    with _cache_lock:
+        cache = read_cache(output_dir)
+        if fingerprint is None:
+            if cache.pop(name, None) is None:
+                return
+        else:
+            cache[name] = fingerprint
+        with open(os.path.join(output_dir, CACHE_FILE), 'w') as fh:
+            json.dump(cache, fh, indent=1)
+
+def terminate_group(process, force=False):
+    """Send SIGTERM (SIGKILL if force) to a child's whole process group"""
+    if process.returncode is not None:
+        return  # Already reaped; its pid may now lead an unrelated group
+    if not hasattr(os, 'killpg'):
+        process.kill() if force else process.terminate()
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass  # Group already gone
+
+def start_alignment(job, log):
+    """Launch the hisat2 (| samtools sort) pipeline for one job dict
+
+    Returns a run dict holding the processes and the read end of their shared
+    log pipe. Returns True instead when the output is already up to date and
+    False when the pipeline could not be started.
+    """
+    name = job['name']
+
+    # Create output directory if needed
+    try:
+        os.makedirs(job['output_dir'], exist_ok=True)
+    except OSError as e:
+        log(f"Error creating output directory for {name}: {str(e)}", 'error')
+        return False
+    sam_path = os.path.join(job['output_dir'], f"{name}.sam")
+    sorted_ext = 'cram' if job['cram_reference'] else 'bam'
+    sorted_path = os.path.join(job['output_dir'], f"{name}.{sorted_ext}")
+
+    # Build HISAT2 command as an argv list (no shell, paths with spaces stay intact)
+    cmd = [find_executable(job['hisat2']), '-x', job['index'], '-p', str(job['threads']),
+           f"--{job['preset']}"]
+    if job['dta']:
+        cmd.append('--dta')
+
+    # Add strand-specific options if enabled
+    if job['strandness']:
+        cmd += ['--rna-strandness', job['strandness']]
+
+    # Add input files
+    if len(job['files']) == 1:
+        cmd += ['-U', job['files'][0]]
+    else:
+        cmd += ['-1', job['files'][0], '-2', job['files'][1]]
+
+    # Add output (SAM streams straight into samtools sort when BAM/CRAM is requested)
+    sort_cmd = None
+    if job['to_bam']:
+        sort_cmd = [find_executable(job['samtools']), 'sort', '-@', str(job['threads']), '-m', job['sort_memory']]
+        if job['cram_reference']:
+            # No lzma for fast compression
+            cram_format = 'cram,version=3.1' + ('' if job['fast_compression'] else ',use_lzma=1')
+            sort_cmd += ['--output-fmt', cram_format, '--reference', job['cram_reference']]
+        else:
+            sort_cmd += ['-O', 'bam']
+        if job['fast_compression']:
+            sort_cmd += ['-l', '1']
+    else:
+        cmd += ['-S', sam_path]
+
+    # Skip samples whose output is already up to date
+    target = sorted_path if sort_cmd else sam_path
+    inputs = job['files'] + ([job['cram_reference']] if sort_cmd and job['cram_reference'] else [])
+    try:
+        fingerprint = alignment_fingerprint(job['index'], inputs, cmd + (sort_cmd or []))
+    except OSError:
+        fingerprint = None  # Missing inputs; let hisat2 report them
+    if (fingerprint and read_cache(job['output_dir']).get(name) == fingerprint
+            and os.path.isfile(target) and os.path.getsize(target) > 0):
+        log(f"Skipping {name} (cached): {target} is up to date", 'info')
+        return True
+    try:
+        update_cache(job['output_dir'], name, None)
+    except OSError as e:
+        log(f"Error updating the output cache for {name}: {str(e)}", 'error')
+        return False
+
+    # Sort on local scratch, indexing in the same pass
+    work_dir = None
+    if sort_cmd:
+        try:
+            work_dir = tempfile.mkdtemp(prefix=f"hisat2sort.{name}.", dir=job['scratch_dir'] or job['output_dir'])
+        except OSError as e:
+            log(f"Error creating scratch directory for {name}: {str(e)}", 'error')
+            return False
+        work_path = os.path.join(work_dir, os.path.basename(sorted_path))
+        sort_cmd += ['-T', os.path.join(work_dir, name), '--write-index',
+                     '-o', f"{work_path}##idx##{work_path}{INDEX_SUFFIXES[sorted_ext]}", '-']
+
+    # Batch samples share one memory-mapped index (output unchanged, so not fingerprinted)
+    if job['shared_index']:
+        cmd.insert(cmd.index('-x'), '--mm')
+
+    # Stream gzipped single-end reads in from pigz on another core
+    unzip_cmd = None
+    if job['pigz'] and len(job['files']) == 1 and job['files'][0].endswith('.gz'):
+        unzip_cmd = [find_executable('pigz'), '-dc', job['files'][0]]
+        cmd[cmd.index('-U') + 1] = '-'
+
+    # Run HISAT2
+    log(f"Starting alignment for {name}...", 'info')
+    log("Command: " + " | ".join(" ".join(part) for part in (unzip_cmd, cmd, sort_cmd) if part), 'command')
+
+    # Each stage leads its own process group (forgoing posix_spawn) so Stop reaches its children
+    processes = []
+    log_r, log_w = os.pipe()
+    try:
+        # All stages report through one shared log pipe
+        if unzip_cmd:
+            processes.append(subprocess.Popen(unzip_cmd, stdout=subprocess.PIPE, stderr=log_w,
+                                              start_new_session=True))
+        aligner = subprocess.Popen(cmd, stdin=processes[0].stdout if unzip_cmd else None,
+                                   stdout=subprocess.PIPE if sort_cmd else log_w, stderr=log_w,
+                                   start_new_session=True)
+        processes.append(aligner)
+        if unzip_cmd:
+            processes[0].stdout.close()
+        if sort_cmd:
+            # sort writes through -o; nothing it prints on stdout is wanted
+            processes.append(subprocess.Popen(sort_cmd, stdin=aligner.stdout, stdout=subprocess.DEVNULL,
+                                              stderr=log_w, start_new_session=True))
+            aligner.stdout.close()
+    except Exception as e:
+        log(f"Error running alignment for {name}: {str(e)}", 'error')
+        for process in processes:
+            if process.stdout:
+                process.stdout.close()
+            process.kill()
+            process.wait()
+        os.close(log_r)
+        if work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return False
+    finally:
+        os.close(log_w)
+
+    return {'job': job, 'processes': processes, 'fd': log_r, 'partial': b'',
+            'fingerprint': fingerprint, 'work_dir': work_dir, 'sorted_path': sorted_path if sort_cmd else None,
+            'sam_path': None if sort_cmd else sam_path}
+
+def remove_uncached(path):
+    """Delete a (possibly multi-GB) file, evicting its pages from the page cache first"""
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            pass
+        else:
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+    os.remove(path)
+
+def move_into_place(src, dst):
+    """Atomically replace dst with src, copying when they are on different filesystems"""
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Copy next to the target first, so dst is never seen half-written
+        partial = dst + '.part'
+        try:
+            shutil.copyfile(src, partial)
+            os.replace(partial, dst)
+        finally:
+            if os.path.exists(partial):
+                remove_uncached(partial)
+        remove_uncached(src)
+
+def finish_alignment(run, log):
+    """Reap a pipeline whose log pipe hit EOF and report the outcome"""
+    name = run['job']['name']
+    returncodes = [process.wait() for process in run['processes']]
+    # Like pipefail: the last failing stage is the cause, earlier ones die of SIGPIPE
+    returncode = next((code for code in reversed(returncodes) if code), 0)
+    succeeded = False
+    try:
+        if returncode != 0:
+            log(f"Alignment of {name} failed with code {returncode}", 'error')
+            return False
+
+        log(f"Alignment of {name} completed successfully", 'success')
+        if run['sorted_path']:
+            sorted_ext = os.path.splitext(run['sorted_path'])[1][1:]
+            work_path = os.path.join(run['work_dir'], os.path.basename(run['sorted_path']))
+            for suffix in ('', INDEX_SUFFIXES[sorted_ext]):
+                move_into_place(work_path + suffix, run['sorted_path'] + suffix)
+            log(f"Sorted {sorted_ext.upper()} written to {run['sorted_path']} (indexed)", 'success')
+    except OSError as e:
+        log(f"Error moving sorted output for {name} into place: {str(e)}", 'error')
+        return False
+    else:
+        succeeded = True
+        if run['fingerprint']:
+            try:
+                update_cache(run['job']['output_dir'], name, run['fingerprint'])
+            except OSError as e:
+                log(f"Could not record {name} in the output cache: {str(e)}", 'warning')
+        return True
+    finally:
+        # Never leave scratch files or a truncated SAM from a failed run behind
+        if run['work_dir']:
+            shutil.rmtree(run['work_dir'], ignore_errors=True)
+        if not succeeded and run['sam_path'] and os.path.exists(run['sam_path']):
+            remove_uncached(run['sam_path'])
+
+def align_samples(jobs, workers, log, stop_event, active, progress=None):
+    """Align job dicts, at most `workers` at a time; returns the number that succeeded"""
+    pending = iter(jobs)
+    succeeded = done = 0
+
+    def sample_done(ok):
+        nonlocal succeeded, done
+        succeeded += ok
+        done += 1
+        if progress:
+            progress(100 * done / len(jobs))
+
+    def reap(run):
+        # Out of the active set before any slow move, so Stop can't signal reaped pids
+        for process in run['processes']:
+            process.wait()
+        active.difference_update(run['processes'])
+
+    with selectors.DefaultSelector() as selector:
+        try:
+            while True:
+                # Keep up to `workers` pipelines running
+                while len(selector.get_map()) < workers and not stop_event.is_set():
+                    job = next(pending, None)
+                    if job is None:
+                        break
+                    run = start_alignment(job, log)
+                    if isinstance(run, bool):
+                        sample_done(run)
+                        continue
+                    active.update(run['processes'])
+                    selector.register(run['fd'], selectors.EVENT_READ, run)
+                    if stop_event.is_set():  # Stop pressed while this one was starting
+                        for process in run['processes']:
+                            terminate_group(process)
+
+                if not selector.get_map():
+                    break
+
+                # Forward complete log lines as they arrive from any pipeline
+                finished = []
+                for key, _ in selector.select(timeout=0.1):
+                    run = key.data
+                    data = os.read(key.fd, 65536)
+                    if data:
+                        *lines, run['partial'] = (run['partial'] + data).split(b'\n')
+                    else:
+                        lines = [run['partial']] if run['partial'] else []
+                        finished.append(key)
+                    for line in lines:
+                        log(f"[{run['job']['name']}] {line.decode(errors='replace').strip()}", 'info')
+
+                # After a stop, a surviving grandchild can hold a log pipe open; don't wait for it
+                if stop_event.is_set():
+                    finished += [key for key in selector.get_map().values()
+                                 if key not in finished
+                                 and all(process.poll() is not None for process in key.data['processes'])]
+
+                for key in finished:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    reap(key.data)
+                    sample_done(finish_alignment(key.data, log))
+        finally:
+            # Never leave pipelines running unsupervised if the loop above raised
+            for key in list(selector.get_map().values()):
+                selector.unregister(key.fd)
+                os.close(key.fd)
+                for process in key.data['processes']:
+                    terminate_group(process, force=True)
+                reap(key.data)
+                sample_done(finish_alignment(key.data, log))
+
+    return succeeded
+
 class HISAT2GUI:
     def __init__(self, root):
         self.root = root
@@ -57,7 +458,19 @@ class HISAT2GUI:
 
         # Initialize variables
         self.running = False
+        self.building = False
         self.process = None
+        self._stop_event = threading.Event()
+        self._active_processes = set()
+        # Self-pipe: a byte written here wakes the index build thread to stop it
+        self._stop_r, self._stop_w = os.pipe()
+        os.set_blocking(self._stop_r, False)
+        self._last_dirs = {}
+        self._index_cache = {}
+
+        # Worker threads queue log lines; the Tk main loop flushes them
+        self.log_queue = queue.Queue()
+        self.root.after(100, self._drain_log)
 
         # Configure text tags for colored output
         self.output_text.tag_config('info', foreground='blue')
@@ -67,7 +480,7 @@ class HISAT2GUI:
         self.output_text.tag_config('command', foreground='purple')
 
         # Set default values
-        self.threads.set(4)
+        self.threads.set(available_cpus())
         self.preset_mode.set('sensitive')
         self.alignment_mode.set('single')
 
@@ -98,12 +511,17 @@ class HISAT2GUI:
         self.output_dir = tk.StringVar()
         self.sample_name = tk.StringVar()
         self.threads = tk.IntVar()
+        self.parallel_samples = tk.IntVar(value=1)
         self.preset_mode = tk.StringVar()
         self.alignment_mode = tk.StringVar()
         self.dta_mode = tk.BooleanVar(value=False)
         self.strand_specific = tk.BooleanVar(value=False)
         self.strand_direction = tk.StringVar(value='unstranded')
         self.convert_to_bam = tk.BooleanVar(value=True)
+        self.fast_compression = tk.BooleanVar(value=False)
+        self.use_pigz = tk.BooleanVar(value=False)
+        self.output_cram = tk.BooleanVar(value=False)
+        self.cram_reference = tk.StringVar()
         self.batch_mode = tk.BooleanVar(value=False)
         self.batch_input_dir = tk.StringVar()
 
@@ -217,7 +635,7 @@ class HISAT2GUI:
 
         # Threads
         ttk.Label(frame, text="Threads:").grid(row=1, column=0, sticky='w', pady=2)
-        ttk.Spinbox(frame, from_=1, to=32, textvariable=self.threads, width=5).grid(row=1, column=1, sticky='w', padx=5)
+        ttk.Spinbox(frame, from_=1, to=available_cpus(), textvariable=self.threads, width=5).grid(row=1, column=1, sticky='w', padx=5)
 
         # DTA mode
         ttk.Checkbutton(frame, text="DTA mode (for StringTie)", variable=self.dta_mode).grid(
@@ -238,9 +656,42 @@ class HISAT2GUI:
         self.strand_frame.grid_remove()
 
         # BAM conversion
-        ttk.Checkbutton(frame, text="Convert to sorted BAM", variable=self.convert_to_bam).grid(
-            row=5, column=0, columnspan=2, sticky='w', pady=2)
-        self.add_tooltip(frame.winfo_children()[-1], "Automatically convert SAM to sorted BAM using samtools")
+        ttk.Checkbutton(frame, text="Convert to sorted BAM", variable=self.convert_to_bam,
+                        command=self.toggle_convert_to_bam).grid(row=5, column=0, columnspan=2, sticky='w', pady=2)
+        self.add_tooltip(frame.winfo_children()[-1], "Pipe HISAT2 output straight into samtools sort (no intermediate SAM file)")
+
+        # Fast BAM compression
+        ttk.Checkbutton(frame, text="Fast compression (intermediate BAM)", variable=self.fast_compression).grid(
+            row=6, column=0, columnspan=2, sticky='w', pady=2)
+        self.add_tooltip(frame.winfo_children()[-1], "Write the BAM at compression level 1: much less CPU, "
+                                                     "somewhat larger files. Useful when the BAM is only fed to other tools")
+
+        # CRAM output
+        self.cram_checkbutton = ttk.Checkbutton(frame, text="Output CRAM instead of BAM", variable=self.output_cram,
+                                                command=self.toggle_output_cram)
+        self.cram_checkbutton.grid(row=7, column=0, columnspan=2, sticky='w', pady=2)
+        self.add_tooltip(self.cram_checkbutton, "Compress the sorted output against the reference genome: "
+                                                     "typically 30-50% smaller than BAM")
+
+        self.cram_frame = ttk.Frame(frame)
+        ttk.Label(self.cram_frame, text="Reference FASTA:").pack(side='left')
+        ttk.Entry(self.cram_frame, textvariable=self.cram_reference, width=25).pack(side='left', padx=5)
+        ttk.Button(self.cram_frame, text="Browse...", command=self.browse_cram_reference).pack(side='left')
+        self.cram_frame.grid(row=8, column=0, columnspan=2, sticky='w', pady=2)
+        self.cram_frame.grid_remove()
+
+        # Parallel samples (batch mode)
+        ttk.Label(frame, text="Parallel samples:").grid(row=9, column=0, sticky='w', pady=2)
+        parallel_spinbox = ttk.Spinbox(frame, from_=1, to=available_cpus(), textvariable=self.parallel_samples, width=5)
+        parallel_spinbox.grid(row=9, column=1, sticky='w', padx=5)
+        self.add_tooltip(parallel_spinbox, "Batch mode: number of samples aligned at the same time, each with the "
+                                           "thread count above. Keep samples x threads within your CPU count")
+
+        # pigz decompression
+        ttk.Checkbutton(frame, text="Decompress .gz reads with pigz", variable=self.use_pigz).grid(
+            row=10, column=0, columnspan=2, sticky='w', pady=2)
+        self.add_tooltip(frame.winfo_children()[-1], "Single-end .fq.gz input is decompressed by pigz and piped "
+                                                     "into HISAT2, taking the work off HISAT2's input thread")
 
     def create_run_buttons(self, parent):
         """Create run control buttons"""
@@ -261,6 +712,9 @@ class HISAT2GUI:
         frame = ttk.LabelFrame(parent, text="Alignment Log", padding=10)
         frame.pack(fill='both', expand=True, pady=5)
 
+        self.progress = ttk.Progressbar(frame, mode='determinate', maximum=100)
+        self.progress.pack(fill='x', pady=(0, 5))
+
         self.output_text = scrolledtext.ScrolledText(frame, wrap=tk.WORD, width=80, height=20)
         self.output_text.pack(fill='both', expand=True)
 
@@ -279,7 +733,7 @@ class HISAT2GUI:
         # Variables
         self.index_fasta = tk.StringVar()
         self.index_base = tk.StringVar()
-        self.index_threads = tk.IntVar(value=4)
+        self.index_threads = tk.IntVar(value=available_cpus())
 
         # Main frame
         main_frame = ttk.Frame(tab, padding=10)
@@ -297,18 +751,30 @@ class HISAT2GUI:
 
         # Threads
         ttk.Label(main_frame, text="Threads:").grid(row=2, column=0, sticky='w', pady=5)
-        ttk.Spinbox(main_frame, from_=1, to=32, textvariable=self.index_threads, width=5).grid(
+        ttk.Spinbox(main_frame, from_=1, to=available_cpus(), textvariable=self.index_threads, width=5).grid(
             row=2, column=1, sticky='w', padx=5)
 
         # Run button
-        ttk.Button(main_frame, text="Build Index", command=self.build_index).grid(
-            row=3, column=1, pady=10, sticky='e')
+        self.build_button = ttk.Button(main_frame, text="Build Index", command=self.build_index)
+        self.build_button.grid(row=3, column=1, pady=10, sticky='e')
+        self.index_stop_button = ttk.Button(main_frame, text="Stop", command=self.stop_index_build,
+                                            state='disabled')
+        self.index_stop_button.grid(row=3, column=2, pady=10, padx=5)
 
         # Output console
         ttk.Label(main_frame, text="Build Log:").grid(row=4, column=0, sticky='w', pady=5)
+        self.index_progress = ttk.Progressbar(main_frame, mode='determinate', maximum=100)
+        self.index_progress.grid(row=4, column=1, columnspan=2, sticky='ew', pady=5)
         self.index_output = scrolledtext.ScrolledText(main_frame, wrap=tk.WORD, width=80, height=10)
         self.index_output.grid(row=5, column=0, columnspan=3, sticky='nsew')
 
+        # Configure tags for colored text
+        self.index_output.tag_config('info', foreground='blue')
+        self.index_output.tag_config('success', foreground='green')
+        self.index_output.tag_config('warning', foreground='orange')
+        self.index_output.tag_config('error', foreground='red')
+        self.index_output.tag_config('command', foreground='purple')
+
         # Configure grid weights
         main_frame.columnconfigure(1, weight=1)
         main_frame.rowconfigure(5, weight=1)
@@ -334,9 +800,26 @@ class HISAT2GUI:
         ttk.Entry(main_frame, textvariable=self.samtools_path, width=50).grid(row=1, column=1, sticky='we', padx=5)
         ttk.Button(main_frame, text="Browse...", command=self.browse_samtools).grid(row=1, column=2, padx=5)
 
+        # Samtools sort memory
+        ttk.Label(main_frame, text="Sort Memory per Thread:").grid(row=2, column=0, sticky='w', pady=5)
+        self.sort_mem_per_thread = tk.StringVar(value='1G')
+        sort_mem_entry = ttk.Entry(main_frame, textvariable=self.sort_mem_per_thread, width=10)
+        sort_mem_entry.grid(row=2, column=1, sticky='w', padx=5)
+        self.add_tooltip(sort_mem_entry, "Memory per samtools sort thread (e.g. 768M, 2G). More memory means "
+                                         "fewer temporary files to merge, but total use is this times the thread count")
+
+        # Scratch directory for sorting
+        ttk.Label(main_frame, text="Scratch Directory:").grid(row=3, column=0, sticky='w', pady=5)
+        self.scratch_dir = tk.StringVar(value=tempfile.gettempdir())
+        scratch_entry = ttk.Entry(main_frame, textvariable=self.scratch_dir, width=50)
+        scratch_entry.grid(row=3, column=1, sticky='we', padx=5)
+        ttk.Button(main_frame, text="Browse...", command=self.browse_scratch_dir).grid(row=3, column=2, padx=5)
+        self.add_tooltip(scratch_entry, "Fast local disk where BAM files are sorted before being moved to the "
+                                        "output directory (leave empty to sort in the output directory)")
+
         # Help section
         help_frame = ttk.LabelFrame(main_frame, text="Help & Documentation", padding=10)
-        help_frame.grid(row=2, column=0, columnspan=3, sticky='nsew', pady=10)
+        help_frame.grid(row=4, column=0, columnspan=3, sticky='nsew', pady=10)
 
         help_text = """
 HISAT2 GUI - User Guide
@@ -367,7 +850,7 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
         # Documentation button
         ttk.Button(main_frame, text="Open Online Documentation",
                   command=lambda: webbrowser.open("https://github.com/yourusername/hisat2-gui")).grid(
-                      row=3, column=1, pady=10)
+                      row=5, column=1, pady=10)
 
     def create_status_bar(self):
         """Create status bar at bottom of window"""
@@ -417,6 +900,24 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
         else:
             self.strand_frame.grid_remove()
 
+    def toggle_convert_to_bam(self):
+        """Offer CRAM output only when the alignments are sorted"""
+        if self.convert_to_bam.get():
+            self.cram_checkbutton.config(state='normal')
+        else:
+            self.output_cram.set(False)
+            self.toggle_output_cram()
+            self.cram_checkbutton.config(state='disabled')
+
+    def toggle_output_cram(self):
+        """Toggle the CRAM reference field, defaulting it to the index FASTA"""
+        if self.output_cram.get():
+            if not self.cram_reference.get():
+                self.cram_reference.set(self.index_fasta.get())
+            self.cram_frame.grid()
+        else:
+            self.cram_frame.grid_remove()
+
     def update_input_fields(self, *args):
         """Update input fields based on alignment mode"""
         if self.alignment_mode.get() == 'paired':
@@ -424,87 +925,121 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
         else:
             self.paired_frame.pack_forget()
 
+    def _initial_dir(self, kind):
+        """Starting directory for a file dialog, remembered per kind of dialog"""
+        return self._last_dirs.get(kind, os.path.expanduser('~'))
+
+    def _remember_dir(self, kind, path):
+        """Remember where the user last picked something for this kind of dialog"""
+        self._last_dirs[kind] = path if os.path.isdir(path) else os.path.dirname(path)
+
     def browse_index(self):
         """Browse for HISAT2 index"""
-        path = filedialog.askopenfilename(title="Select HISAT2 Index File",
+        path = filedialog.askopenfilename(title="Select HISAT2 Index File", initialdir=self._initial_dir('index'),
                                          filetypes=[("HISAT2 Index", "*.ht2"), ("All files", "*.*")])
         if path:
+            self._remember_dir('index', path)
             # Remove the .1.ht2 suffix if present
-            base_path = re.sub(r'\.\d+\.ht2$', '', path)
+            base_path = _HT2_SUFFIX.sub('', path)
             self.index_path.set(base_path)
 
     def browse_input_file(self):
         """Browse for input FASTQ file"""
-        path = filedialog.askopenfilename(title="Select FASTQ File",
+        path = filedialog.askopenfilename(title="Select FASTQ File", initialdir=self._initial_dir('fastq'),
                                         filetypes=[("FASTQ Files", "*.fastq *.fq *.fastq.gz *.fq.gz"), ("All files", "*.*")])
         if path:
+            self._remember_dir('fastq', path)
             self.input_files.set(path)
 
     def browse_input_file2(self):
         """Browse for second FASTQ file (paired-end)"""
-        path = filedialog.askopenfilename(title="Select Second FASTQ File (R2)",
+        path = filedialog.askopenfilename(title="Select Second FASTQ File (R2)", initialdir=self._initial_dir('fastq'),
                                         filetypes=[("FASTQ Files", "*.fastq *.fq *.fastq.gz *.fq.gz"), ("All files", "*.*")])
         if path:
+            self._remember_dir('fastq', path)
             self.input_files2.set(path)
 
     def browse_output_dir(self):
         """Browse for output directory"""
-        path = filedialog.askdirectory(title="Select Output Directory")
+        path = filedialog.askdirectory(title="Select Output Directory", initialdir=self._initial_dir('output'))
         if path:
+            self._remember_dir('output', path)
             self.output_dir.set(path)
 
     def browse_batch_dir(self):
         """Browse for batch input directory"""
-        path = filedialog.askdirectory(title="Select Input Directory with FASTQ Files")
+        path = filedialog.askdirectory(title="Select Input Directory with FASTQ Files", initialdir=self._initial_dir('fastq'))
         if path:
+            self._remember_dir('fastq', path)
             self.batch_input_dir.set(path)
 
+    def browse_scratch_dir(self):
+        """Browse for scratch directory used while sorting"""
+        path = filedialog.askdirectory(title="Select Scratch Directory", initialdir=self._initial_dir('scratch'))
+        if path:
+            self._remember_dir('scratch', path)
+            self.scratch_dir.set(path)
+
     def browse_fasta(self):
         """Browse for reference FASTA file"""
-        path = filedialog.askopenfilename(title="Select Reference FASTA File",
+        path = filedialog.askopenfilename(title="Select Reference FASTA File", initialdir=self._initial_dir('fasta'),
                                         filetypes=[("FASTA Files", "*.fa *.fasta *.fna"), ("All files", "*.*")])
         if path:
+            self._remember_dir('fasta', path)
             self.index_fasta.set(path)
 
+    def browse_cram_reference(self):
+        """Browse for the reference FASTA used to compress CRAM output"""
+        path = filedialog.askopenfilename(title="Select CRAM Reference FASTA", initialdir=self._initial_dir('fasta'),
+                                        filetypes=[("FASTA Files", "*.fa *.fasta *.fna *.fa.gz *.fasta.gz"),
+                                                   ("All files", "*.*")])
+        if path:
+            self._remember_dir('fasta', path)
+            self.cram_reference.set(path)
+
     def browse_index_output(self):
         """Browse for index output location"""
-        path = filedialog.asksaveasfilename(title="Save Index As",
+        path = filedialog.asksaveasfilename(title="Save Index As", initialdir=self._initial_dir('index'),
                                           filetypes=[("HISAT2 Index", "*.ht2"), ("All files", "*.*")],
                                           defaultextension=".ht2")
         if path:
+            self._remember_dir('index', path)
             # Remove the .1.ht2 suffix if present
-            base_path = re.sub(r'\.\d+\.ht2$', '', path)
+            base_path = _HT2_SUFFIX.sub('', path)
             self.index_base.set(base_path)
 
     def browse_hisat2(self):
         """Browse for HISAT2 executable"""
-        path = filedialog.askopenfilename(title="Select HISAT2 Executable",
+        path = filedialog.askopenfilename(title="Select HISAT2 Executable", initialdir=self._initial_dir('tools'),
                                         filetypes=[("Executable", "hisat2*"), ("All files", "*.*")])
         if path:
+            self._remember_dir('tools', path)
             self.hisat2_path.set(path)
 
     def browse_samtools(self):
         """Browse for samtools executable"""
-        path = filedialog.askopenfilename(title="Select Samtools Executable",
+        path = filedialog.askopenfilename(title="Select Samtools Executable", initialdir=self._initial_dir('tools'),
                                         filetypes=[("Executable", "samtools*"), ("All files", "*.*")])
         if path:
+            self._remember_dir('tools', path)
             self.samtools_path.set(path)
 
     def find_hisat2(self):
         """Try to find HISAT2 in system PATH"""
-        try:
-            path = subprocess.check_output(['which', 'hisat2']).decode().strip()
-            return path
-        except:
-            return "hisat2"  # Default to hoping it's in PATH
+        return find_executable('hisat2')
 
     def find_samtools(self):
         """Try to find samtools in system PATH"""
-        try:
-            path = subprocess.check_output(['which', 'samtools']).decode().strip()
-            return path
-        except:
-            return "samtools"  # Default to hoping it's in PATH
+        return find_executable('samtools')
+
+    def index_exists(self, base):
+        """Check that all 8 index files exist, remembering indexes already found"""
+        if base not in self._index_cache:
+            if not all(os.path.exists(f"{base}.{i}.ht2") or os.path.exists(f"{base}.{i}.ht2l")
+                       for i in range(1, 9)):
+                return False  # Not cached, the user may still build or copy it
+            self._index_cache[base] = True
+        return True
 
     def validate_inputs(self):
         """Validate user inputs before running"""
@@ -512,6 +1047,11 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
             messagebox.showerror("Error", "Please select a HISAT2 index")
             return False
 
+        if not self.index_exists(self.index_path.get()):
+            messagebox.showerror("Error", f"No complete HISAT2 index found at {self.index_path.get()}\n"
+                                          "(expected .1.ht2 to .8.ht2 files)")
+            return False
+
         if self.batch_mode.get():
             if not self.batch_input_dir.get():
                 messagebox.showerror("Error", "Please select an input directory for batch mode")
@@ -528,8 +1068,80 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
             messagebox.showerror("Error", "Please select an output directory")
             return False
 
+        threads = self.checked_threads(self.threads)
+        if threads is None:
+            return False
+
+        parallel = 1
+        if self.batch_mode.get():
+            cpus = available_cpus()
+            try:
+                parallel = self.parallel_samples.get()
+            except tk.TclError:
+                parallel = 1
+                self.parallel_samples.set(parallel)
+            if parallel > 1 and parallel * threads > cpus and not messagebox.askyesno(
+                    "Warning", f"{parallel} parallel samples x {threads} threads needs {parallel * threads} CPUs, "
+                               f"but only {cpus} are available. Oversubscribed runs are usually slower.\n\n"
+                               "Continue anyway?"):
+                return False
+
+        if self.convert_to_bam.get() and self.scratch_dir.get() and not os.path.isdir(self.scratch_dir.get()):
+            messagebox.showerror("Error", "Scratch directory does not exist")
+            return False
+
+        if self.convert_to_bam.get() and not re.fullmatch(r'\d+[KMG]?', self.sort_mem_per_thread.get(), re.I):
+            messagebox.showerror("Error", "Sort memory per thread must look like 768M or 2G")
+            return False
+
+        # samtools sort allocates -m per thread, for every sample running at once
+        if self.convert_to_bam.get():
+            sort_total = parse_size(self.sort_mem_per_thread.get()) * threads * parallel
+            ram = physical_memory()
+            if ram and sort_total > ram and not messagebox.askyesno(
+                    "Warning", f"Sorting needs {sort_total / 1024 ** 3:.1f} GB ({self.sort_mem_per_thread.get()} "
+                               f"x {threads} threads x {parallel} samples), more than the "
+                               f"{ram / 1024 ** 3:.1f} GB of RAM in this machine, before HISAT2's own "
+                               "index memory. Lower the sort memory or threads to avoid swapping.\n\n"
+                               "Continue anyway?"):
+                return False
+
+        if self.output_cram.get() and not self.convert_to_bam.get():
+            messagebox.showerror("Error", "CRAM output needs \"Convert to sorted BAM\" enabled")
+            return False
+
+        if self.output_cram.get() and not os.path.isfile(self.cram_reference.get()):
+            messagebox.showerror("Error", "CRAM output needs the reference FASTA the index was built from")
+            return False
+
+        if self.use_pigz.get() and not shutil.which(find_executable('pigz')):
+            messagebox.showerror("Error", "pigz was not found in PATH")
+            return False
+
         return True
 
+    def checked_threads(self, var):
+        """Read a thread count, treating blank/'auto' as all available CPUs
+
+        Asks before running with more threads than CPUs; returns None if the
+        user backs out.
+        """
+        cpus = available_cpus()
+        try:
+            threads = var.get()
+        except tk.TclError:
+            threads = 0
+        if threads < 1:
+            threads = cpus
+            var.set(threads)
+
+        if threads > cpus and not messagebox.askyesno(
+                "Warning", f"{threads} threads requested but only {cpus} CPUs are available. "
+                           "Oversubscribed threads compete for cores and memory bandwidth and "
+                           "usually make alignment slower.\n\nContinue anyway?"):
+            return None
+        return threads
+
     def run_alignment(self):
         """Run the HISAT2 alignment process"""
         if self.running:
@@ -539,12 +1151,14 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
             return
 
         self.running = True
+        self._stop_event.clear()
         self.stop_button.config(state='normal')
 
         # Clear output
         self.output_text.config(state='normal')
         self.output_text.delete(1.0, tk.END)
         self.output_text.config(state='disabled')
+        self.progress.config(value=0)
 
         # Start alignment in a separate thread
         threading.Thread(target=self._run_alignment_thread, daemon=True).start()
@@ -563,94 +1177,55 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
             self.root.after(0, lambda: self.stop_button.config(state='disabled'))
             self.log_message("Alignment finished", 'info')
 
+    def _alignment_job(self, name, files):
+        """Capture the current alignment settings for one sample as a plain dict"""
+        strandness = None
+        if self.strand_specific.get() and self.strand_direction.get() in ('fr', 'rf'):
+            strandness = self.strand_direction.get().upper()
+
+        return {
+            'name': name,
+            'files': files,
+            'index': self.index_path.get(),
+            'output_dir': self.output_dir.get(),
+            'threads': self.threads.get(),
+            'preset': self.preset_mode.get(),
+            'dta': self.dta_mode.get(),
+            'strandness': strandness,
+            'to_bam': self.convert_to_bam.get(),
+            'fast_compression': self.fast_compression.get(),
+            'pigz': self.use_pigz.get(),
+            'sort_memory': self.sort_mem_per_thread.get(),
+            'cram_reference': self.cram_reference.get() if self.output_cram.get() else None,
+            'scratch_dir': self.scratch_dir.get(),
+            'hisat2': self.hisat2_path.get(),
+            'samtools': self.samtools_path.get(),
+            'shared_index': self.batch_mode.get(),
+        }
+
     def run_single_alignment(self):
         """Run alignment for a single sample"""
-        # Get input parameters
-        index = self.index_path.get()
-        output_dir = self.output_dir.get()
-        threads = self.threads.get()
-        preset = self.preset_mode.get()
-        dta = '--dta' if self.dta_mode.get() else ''
-
-        # Create output directory if needed
-        os.makedirs(output_dir, exist_ok=True)
+        files = [self.input_files.get()]
+        if self.alignment_mode.get() == 'paired':
+            files.append(self.input_files2.get())
 
         # Determine output filename
         if self.sample_name.get():
             base_name = self.sample_name.get()
         else:
-            base_name = Path(self.input_files.get()).stem.replace('.fastq', '').replace('.fq', '')
-        sam_path = os.path.join(output_dir, f"{base_name}.sam")
-
-        # Build HISAT2 command
-        cmd = [
-            self.hisat2_path.get(),
-            f"-x {index}",
-            f"-p {threads}",
-            f"--{preset}",
-            dta
-        ]
-
-        # Add strand-specific options if enabled
-        if self.strand_specific.get():
-            strand = self.strand_direction.get()
-            if strand == 'fr':
-                cmd.append('--rna-strandness FR')
-            elif strand == 'rf':
-                cmd.append('--rna-strandness RF')
-
-        # Add input files
-        if self.alignment_mode.get() == 'single':
-            cmd.append(f"-U {self.input_files.get()}")
-        else:
-            cmd.append(f"-1 {self.input_files.get()} -2 {self.input_files2.get()}")
-
-        # Add output
-        cmd.append(f"-S {sam_path}")
-
-        # Run HISAT2
-        self.log_message(f"Starting alignment for {base_name}...", 'info')
-        self.log_message("Command: " + " ".join(cmd), 'command')
-
-        try:
-            process = subprocess.Popen(" ".join(cmd), shell=True, stdout=subprocess.PIPE,
-                                     stderr=subprocess.STDOUT, universal_newlines=True)
+            base_name = fastq_sample_name(self.input_files.get(), paired=len(files) == 2)
 
-            # Save process reference for possible termination
-            self.process = process
-
-            # Read output in real-time
-            for line in process.stdout:
-                self.log_message(line.strip(), 'info')
-                if self.running == False:
-                    process.terminate()
-                    break
-
-            process.wait()
-
-            if process.returncode == 0:
-                self.log_message("Alignment completed successfully", 'success')
-
-                # Convert to BAM if requested
-                if self.convert_to_bam.get():
-                    self.convert_to_bam(sam_path)
-            else:
-                self.log_message(f"Alignment failed with code {process.returncode}", 'error')
-
-        except Exception as e:
-            self.log_message(f"Error running alignment: {str(e)}", 'error')
-        finally:
-            self.process = None
+        align_samples([self._alignment_job(base_name, files)], 1, self.log_message,
+                      self._stop_event, self._active_processes, self.set_progress)
 
     def run_batch_alignment(self):
         """Run alignment for all files in a directory"""
         input_dir = self.batch_input_dir.get()
-        output_dir = self.output_dir.get()
 
-        # Find all FASTQ files
-        fastq_files = []
-        for ext in ['*.fastq', '*.fq', '*.fastq.gz', '*.fq.gz']:
-            fastq_files.extend(Path(input_dir).glob(ext))
+        # Find all FASTQ files (a single directory pass instead of one glob per extension)
+        with os.scandir(input_dir) as entries:
+            fastq_files = [(entry.path, entry.name) for entry in entries
+                           if entry.name.endswith(FASTQ_EXTENSIONS) and entry.is_file()]
 
         if not fastq_files:
             self.log_message("No FASTQ files found in input directory", 'error')
@@ -660,132 +1235,135 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
         if self.alignment_mode.get() == 'paired':
             samples = self.group_paired_files(fastq_files)
         else:
-            samples = [{'name': f.stem.replace('.fastq', '').replace('.fq', ''), 'files': [str(f)]}
-                      for f in fastq_files]
-
-        # Process each sample
-        for sample in samples:
-            if not self.running:
-                break
+            samples = [{'name': fastq_sample_name(name), 'files': [path]} for path, name in fastq_files]
 
-            self.input_files.set(sample['files'][0])
-            if self.alignment_mode.get() == 'paired':
-                self.input_files2.set(sample['files'][1])
-            self.sample_name.set(sample['name'])
+        if not samples:
+            return
 
-            self.run_single_alignment()
+        jobs = [self._alignment_job(sample['name'], sample['files']) for sample in samples]
+        prefetch_index(self.index_path.get())
+        workers = max(1, min(self.parallel_samples.get(), len(jobs)))
+        self.log_message(f"Aligning {len(jobs)} samples, {workers} at a time", 'info')
 
-    def group_paired_files(self, files):
-        """Group paired-end FASTQ files"""
-        # Implement proper pairing logic (e.g., _R1/_R2, .1/.2, etc.)
-        # This is a simplified version - should be enhanced for production
-        files = sorted([str(f) for f in files])
-        samples = []
+        succeeded = align_samples(jobs, workers, self.log_message, self._stop_event,
+                                  self._active_processes, self.set_progress)
 
-        i = 0
-        while i < len(files):
-            if i + 1 >= len(files):
-                self.log_message(f"Unpaired file: {files[i]}", 'warning')
-                break
+        self.log_message(f"Batch finished: {succeeded} of {len(jobs)} samples aligned",
+                         'success' if succeeded == len(jobs) else 'warning')
 
-            # Simple pairing by filename (without _R1/_R2)
-            base1 = files[i].replace('_R1', '').replace('.1', '').replace('.fastq', '').replace('.fq', '')
-            base2 = files[i+1].replace('_R2', '').replace('.2', '').replace('.fastq', '').replace('.fq', '')
+    def group_paired_files(self, files):
+        """Group paired-end FASTQ files (_R1/_R2, _1/_2, .1/.2, optional Illumina _001)
+
+        files holds (path, file name) tuples as listed from the input directory.
+        """
+        # Key every file by its name without the mate suffix, then pair up per key
+        groups = defaultdict(dict)
+        for f, name in sorted(files):
+            match = _MATE_SUFFIX.search(name)
+            if not match:
+                self.log_message(f"Unpaired file: {f}", 'warning')
+                continue
+            mates = groups[name[:match.start()]]
+            if match.group(1) in mates:
+                self.log_message(f"Ignoring {f}: mate {match.group(1)} already taken by {mates[match.group(1)]}",
+                                 'warning')
+                continue
+            mates[match.group(1)] = f
 
-            if base1 == base2:
-                sample_name = Path(files[i]).stem.replace('_R1', '').replace('.1', '')
+        samples = []
+        for sample_name, mates in groups.items():
+            if '1' in mates and '2' in mates:
                 samples.append({
                     'name': sample_name,
-                    'files': [files[i], files[i+1]]
+                    'files': [mates['1'], mates['2']]
                 })
-                i += 2
             else:
-                self.log_message(f"Could not pair file: {files[i]}", 'warning')
-                i += 1
+                for f in mates.values():
+                    self.log_message(f"Could not pair file: {f}", 'warning')
 
         return samples
 
-    def convert_to_bam(self, sam_path):
-        """Convert SAM to sorted BAM using samtools"""
-        bam_path = sam_path.replace('.sam', '.bam')
-        sorted_prefix = bam_path.replace('.bam', '')
-
-        self.log_message(f"Converting {sam_path} to sorted BAM...", 'info')
-
-        # View command (SAM to BAM)
-        cmd1 = f"{self.samtools_path.get()} view -b -o {bam_path} {sam_path}"
-        self.log_message("Command: " + cmd1, 'command')
-
-        # Sort command
-        cmd2 = f"{self.samtools_path.get()} sort -o {sorted_prefix}.sorted.bam {bam_path}"
-        self.log_message("Command: " + cmd2, 'command')
-
-        try:
-            # Run view command
-            result = subprocess.run(cmd1, shell=True, check=True,
-                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.log_message(result.stderr.decode(), 'info')
-
-            # Run sort command
-            result = subprocess.run(cmd2, shell=True, check=True,
-                                  stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.log_message(result.stderr.decode(), 'info')
-
-            # Clean up intermediate files
-            os.remove(sam_path)
-            os.remove(bam_path)
-
-            # Rename sorted file
-            os.rename(f"{sorted_prefix}.sorted.bam", f"{sorted_prefix}.bam")
-
-            self.log_message("BAM conversion completed successfully", 'success')
-
-        except subprocess.CalledProcessError as e:
-            self.log_message(f"Error converting to BAM: {e.stderr.decode()}", 'error')
-
     def build_index(self):
         """Build a HISAT2 index from a FASTA file"""
+        if self.building:
+            return
+
         fasta = self.index_fasta.get()
         base = self.index_base.get()
-        threads = self.index_threads.get()
 
         if not fasta or not base:
             messagebox.showerror("Error", "Please select FASTA file and enter index base name")
             return
 
+        threads = self.checked_threads(self.index_threads)
+        if threads is None:
+            return
+
         # Clear output
         self.index_output.config(state='normal')
         self.index_output.delete(1.0, tk.END)
         self.index_output.config(state='disabled')
+        self.index_progress.config(value=0)
 
-        # Build command
-        cmd = f"{self.hisat2_path.get()}-build -p {threads} {fasta} {base}"
+        # Build command as an argv list (no shell, paths with spaces stay intact)
+        cmd = [f"{self.hisat2_path.get()}-build", '-p', str(threads), fasta, base]
 
         # Run in a separate thread
-        threading.Thread(target=self._build_index_thread, args=(cmd,), daemon=True).start()
+        self.building = True
+        self.build_button.config(state='disabled')
+        threading.Thread(target=self._build_index_thread, args=(cmd, base), daemon=True).start()
 
-    def _build_index_thread(self, cmd):
+    def _build_index_thread(self, cmd, base):
         """Thread function for building index"""
+        # The files at base are being rewritten; check them afresh next time
+        self._index_cache.pop(base, None)
         self.log_message_to_index("Starting index build...", 'info')
-        self.log_message_to_index("Command: " + cmd, 'command')
+        self.log_message_to_index("Command: " + " ".join(cmd), 'command')
 
+        # Discard a stop request left over from an earlier build
         try:
-            process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                     stderr=subprocess.STDOUT, universal_newlines=True)
+            while os.read(self._stop_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       start_new_session=True)
 
             # Save process reference for possible termination
             self.process = process
-
-            # Read output in real-time
-            for line in process.stdout:
-                self.log_message_to_index(line.strip(), 'info')
-                if self.running == False:
-                    process.terminate()
-                    break
-
+            self.root.after(0, lambda: self.index_stop_button.config(state='normal'))
+
+            # Wait on the output and the stop pipe together
+            stopped = False
+            partial = b''
+            with selectors.DefaultSelector() as selector:
+                selector.register(process.stdout, selectors.EVENT_READ)
+                selector.register(self._stop_r, selectors.EVENT_READ)
+                while selector.get_map().get(process.stdout) and not stopped:
+                    for key, _ in selector.select():
+                        if key.fileobj == self._stop_r:
+                            terminate_group(process)
+                            self.root.after(5000, self._kill_processes, [process])
+                            stopped = True
+                            break
+                        data = os.read(process.stdout.fileno(), 65536)
+                        if data:
+                            *lines, partial = (partial + data).split(b'\n')
+                        else:
+                            lines = [partial]
+                            selector.unregister(process.stdout)
+                        for line in lines:
+                            self._index_log_line(line.decode(errors='replace'))
+
+            process.stdout.close()
             process.wait()
 
-            if process.returncode == 0:
+            if stopped:
+                self.log_message_to_index("Index build stopped by user", 'warning')
+            elif process.returncode == 0:
+                self.set_progress(100, self.index_progress)
                 self.log_message_to_index("Index built successfully", 'success')
             else:
                 self.log_message_to_index(f"Index build failed with code {process.returncode}", 'error')
@@ -794,30 +1372,78 @@ https://github.com/shzadiqbal/hisat2_GUI_unofficial.git
             self.log_message_to_index(f"Error building index: {str(e)}", 'error')
         finally:
             self.process = None
+            self.building = False
+            self.root.after(0, lambda: (self.index_stop_button.config(state='disabled'),
+                                        self.build_button.config(state='normal')))
+
+    def _index_log_line(self, line):
+        """Forward one line of hisat2-build output to the build log or progress bar"""
+        # Block-by-block chatter moves the progress bar rather than filling the log
+        block = _BUILD_BLOCK.search(line)
+        if block:
+            self.set_progress(100 * int(block.group(1)) / int(block.group(2)), self.index_progress)
+        elif line.strip() and not _BUILD_BLOCK_DETAIL.match(line):
+            self.log_message_to_index(line.strip(), 'info')
+
+    def set_progress(self, percent, bar=None):
+        """Move a progress bar, the alignment one by default (safe to call from any thread)"""
+        bar = bar or self.progress
+        self.root.after(0, lambda: bar.config(value=percent))
 
     def log_message(self, message, tag='info'):
-        """Log a message to the main output console"""
-        self.output_text.config(state='normal')
-        self.output_text.insert(tk.END, message + "\n", tag)
-        self.output_text.config(state='disabled')
-        self.output_text.see(tk.END)
-        self.root.update()
+        """Log a message to the main output console (safe to call from any thread)"""
+        self.log_queue.put((self.output_text, message, tag))
 
     def log_message_to_index(self, message, tag='info'):
-        """Log a message to the index builder console"""
-        self.index_output.config(state='normal')
-        self.index_output.insert(tk.END, message + "\n", tag)
-        self.index_output.config(state='disabled')
-        self.index_output.see(tk.END)
-        self.root.update()
+        """Log a message to the index builder console (safe to call from any thread)"""
+        self.log_queue.put((self.index_output, message, tag))
+
+    def _drain_log(self):
+        """Flush queued log messages into their consoles"""
+        pending = []
+        while True:
+            try:
+                pending.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        # One insert per run of same-tag lines instead of one per line
+        for widget, messages in groupby(pending, key=itemgetter(0)):
+            widget.config(state='normal')
+            for tag, group in groupby(messages, key=itemgetter(2)):
+                widget.insert(tk.END, "".join(message + "\n" for _, message, _ in group), tag)
+            # Keep only the most recent lines so long runs don't slow the widget down
+            lines = int(widget.index('end-1c').split('.')[0])
+            if lines > MAX_LOG_LINES:
+                widget.delete('1.0', f"{lines - MAX_LOG_LINES}.0")
+            widget.config(state='disabled')
+            widget.see(tk.END)
+
+        self.root.after(100, self._drain_log)
+
+    def stop_index_build(self):
+        """Stop the current index build"""
+        if self.process is not None:
+            os.write(self._stop_w, b'x')
 
     def stop_alignment(self):
         """Stop the current alignment process"""
-        if self.running and self.process:
-            self.running = False
-            self.process.terminate()
+        # running stays set until the worker thread finishes reaping
+        if self.running and not self._stop_event.is_set():
+            self._stop_event.set()
+            self.stop_button.config(state='disabled')
+            processes = list(self._active_processes)
+            for process in processes:
+                terminate_group(process)
+            # Escalate for anything still ignoring SIGTERM after 5 seconds
+            self.root.after(5000, self._kill_processes, processes)
             self.log_message("Alignment stopped by user", 'warning')
 
+    def _kill_processes(self, processes):
+        """Forcefully end process groups that survived a stop request"""
+        for process in processes:
+            terminate_group(process, force=True)
+
     def show_about(self):
         """Show about dialog"""
         about_text = f"""
@@ -831,7 +1457,7 @@ Features:
 - Batch processing mode
 - Index building utility
 - Real-time progress monitoring
-- SAM to BAM conversion
+- SAM to BAM/CRAM conversion
 
 This is an independent GUI and not affiliated with the original HISAT2 developers.
 """